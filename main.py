@@ -1,15 +1,49 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from googlesearch import search
 import requests
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 import urllib.parse
+import re
+import asyncio
 import random
 import httpx
 
-app = FastAPI()
+# Shared HTTP client, created lazily and reused across requests for connection keep-alive
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared httpx client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=15,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _http_client
+
+async def aclose_http_client():
+    """Close the shared httpx client (called on app shutdown)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+# Shared HTTP client lifecycle: create once at startup, close on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    yield
+    await aclose_http_client()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# Compress large JSON payloads (scrape results, /fetch_data rows) over the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Request Models
 class TimeRequest(BaseModel):
@@ -39,6 +73,9 @@ EMOJI_MAP = {
     "hey": "🙌",
 }
 
+# Pre-compiled keyword alternation: one scan instead of per-keyword substring checks
+_KW_RE = re.compile("|".join(map(re.escape, EMOJI_MAP)))
+
 # Randomized user agents for scraping
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
@@ -54,25 +91,19 @@ HEADERS = {
 # ScraperAPI key
 API_KEY = "d6456f28759b1a12fb7fac335b5dc9f1"
 
+# Bengaluru timezone and the greeting for each hour of the day (0-23)
+IST = timezone(timedelta(hours=5, minutes=30))
+_GREETINGS = ("Good night!",) * 5 + ("Good morning!",) * 7 + ("Good afternoon!",) * 6 + ("Good evening!",) * 4 + ("Good night!",) * 2
+
 # Greeting endpoint
 @app.post("/greet", summary="Get a greeting message")
 async def get_greeting(request: TimeRequest):
-    now_utc = datetime.utcnow()
-    now_bengaluru = now_utc + timedelta(hours=5, minutes=30)
-    hour = request.hour if request.hour is not None else now_bengaluru.hour
+    hour = request.hour if request.hour is not None else datetime.now(IST).hour
 
     if not (0 <= hour <= 23):
         raise HTTPException(status_code=400, detail="Hour must be between 0 and 23.")
 
-    if 5 <= hour < 12:
-        greeting = "Good morning!"
-    elif 12 <= hour < 18:
-        greeting = "Good afternoon!"
-    elif 18 <= hour < 22:
-        greeting = "Good evening!"
-    else:
-        greeting = "Good night!"
-    return {"greeting": greeting}
+    return {"greeting": _GREETINGS[hour]}
 
 # Emoji-processed text
 @app.post("/process", summary="Process text")
@@ -80,11 +111,12 @@ async def process_text(request: TextRequest):
     text = request.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="Text cannot be empty.")
-    emoji = next((emoji for keyword, emoji in EMOJI_MAP.items() if keyword in text.lower()), "✨")
+    match = _KW_RE.search(text.lower())
+    emoji = EMOJI_MAP[match.group(0)] if match else "✨"
     processed_text = f"{text} {emoji}"
     return {"result": processed_text}
 
-# Web search
+# Web search via DuckDuckGo's JSON API (async, no HTML scraping)
 @app.post("/search", summary="Perform a web search")
 async def web_search(request: SearchRequest):
     query = request.query.strip()
@@ -96,50 +128,64 @@ async def web_search(request: SearchRequest):
         raise HTTPException(status_code=400, detail="Number of results must be between 1 and 20.")
 
     try:
-        results = []
-        for i, url in enumerate(search(query, num_results=num_results, lang="en")):
-            results.append({"id": i + 1, "url": url})
+        client = get_http_client()
+        response = await client.get(
+            "https://api.duckduckgo.com/",
+            params={"q": query, "format": "json", "no_html": 1, "skip_disambig": 1}
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        urls = []
+        for topic in data.get("RelatedTopics", []):
+            # Grouped topics nest their results one level deeper
+            for item in topic.get("Topics", [topic]):
+                if item.get("FirstURL"):
+                    urls.append(item["FirstURL"])
+
+        results = [{"id": i + 1, "url": url} for i, url in enumerate(urls[:num_results])]
         return {"results": results} if results else {"results": [], "message": "No results found."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 # Async HTML fetch using ScraperAPI
-async def fetch_html(url):
+async def fetch_html(url, client=None):
     proxy_url = f"http://api.scraperapi.com?api_key={API_KEY}&url={urllib.parse.quote_plus(url)}"
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            response = await client.get(proxy_url)
-            response.raise_for_status()
-            return response.text
+        client = client or get_http_client()
+        response = await client.get(proxy_url)
+        response.raise_for_status()
+        return response.text
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch HTML: {str(e)}")
 
-# Amazon scraper
-@app.post("/scrape_amazon", summary="Scrape Amazon search results by item name")
-async def scrape_amazon(request: ItemRequest):
-    item_name = request.item_name.strip()
-    if not item_name:
-        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
-
-    search_query = urllib.parse.quote(item_name)
-    search_url = f"https://www.amazon.com/s?k={search_query}"
-    html = await fetch_html(search_url)
-
-    soup = BeautifulSoup(html, "html.parser")
-    products = soup.find_all("div", {"data-component-type": "s-search-result"})
+# Walmart selectors, hoisted out of the per-product loop; the price block's
+# spans join with a space separator as "$ 12 34", "$ 12.34", or "$ 1,299 00",
+# with comma-grouped thousands. The lookaheads reject stray trailing digits
+# rather than silently truncating the dollars
+_WM_TITLE_SEL = 'span[data-automation-id="product-title"]'
+_WM_PRICE_SEL = 'div[data-automation-id="product-price"]'
+_WM_LINK_SEL = "a[link-identifier]"
+_WM_PRICE_RE = re.compile(r"\$\s(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)(?![\d,])(?:\s(\d{1,2})(?!\d))?")
+
+# Synchronous parse helpers, shared by the per-retailer endpoints and /scrape_all
+def _parse_amazon(html, search_url):
+    tree = HTMLParser(html)
+    products = tree.css('div[data-component-type="s-search-result"]')
     if not products:
         return {"results": [], "message": "No products found on Amazon."}
 
     results = []
     for product in products:
-        title = product.find("h2", class_="a-size-mini")
-        product_name = title.find("span").get_text(strip=True) if title and title.find("span") else "Not found"
+        title = product.css_first("h2.a-size-mini span")
+        product_name = title.text(strip=True) if title else "Not found"
 
-        price = product.find("span", class_="a-offscreen")
-        product_price = price.get_text(strip=True) if price else "Not found"
+        price = product.css_first("span.a-offscreen")
+        product_price = price.text(strip=True) if price else "Not found"
 
-        link = product.find("a", class_="a-link-normal")
-        product_url = "https://www.amazon.com" + link["href"] if link and "href" in link.attrs else search_url
+        link = product.css_first("a.a-link-normal")
+        href = link.attributes.get("href") if link else None
+        product_url = "https://www.amazon.com" + href if href else search_url
 
         results.append({
             "product_name": product_name,
@@ -149,45 +195,34 @@ async def scrape_amazon(request: ItemRequest):
 
     return {"results": results}
 
-# Walmart scraper using ScraperAPI
-@app.post("/scrape_walmart", summary="Scrape Walmart search results by item name")
-async def scrape_walmart(request: ItemRequest):
-    item_name = request.item_name.strip()
-    if not item_name:
-        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
-
-    search_query = urllib.parse.quote(item_name)
-    search_url = f"https://www.walmart.com/search?q={search_query}"
-    html = await fetch_html(search_url)
-
-    soup = BeautifulSoup(html, "html.parser")
-    products = soup.find_all("div", {"data-item-id": True})
+def _parse_walmart(html, search_url):
+    tree = HTMLParser(html)
+    products = tree.css("div[data-item-id]")
     if not products:
         return {"results": [], "message": "No products found on Walmart."}
 
     results = []
     for product in products:
         # Title
-        title = product.find("span", {"data-automation-id": "product-title"})
-        product_name = title.get_text(strip=True) if title else "Not found"
+        title = product.css_first(_WM_TITLE_SEL)
+        product_name = title.text(strip=True) if title else "Not found"
 
         # Price
         product_price = "Not found"
-        price_div = product.find("div", {"data-automation-id": "product-price"})
+        price_div = product.css_first(_WM_PRICE_SEL)
         if price_div:
-            # Look for spans containing $ and digits
-            dollar_span = price_div.find("span", string=lambda s: s and "$" in s)
-            major_span = price_div.find("span", string=lambda s: s and s.strip().isdigit())
-            minor_span = major_span.find_next_sibling("span") if major_span else None
-
-            if dollar_span and major_span:
-                cents = minor_span.get_text(strip=True) if minor_span else "00"
-                product_price = f"{dollar_span.get_text(strip=True)}{major_span.get_text(strip=True)}.{cents}"
+            match = _WM_PRICE_RE.search(price_div.text(separator=" ", strip=True))
+            if match:
+                dollars = match.group(1)
+                if "." in dollars:
+                    product_price = f"${dollars}"
+                else:
+                    product_price = f"${dollars}.{match.group(2) or '00'}"
 
         # URL
-        link = product.find("a", {"link-identifier": True})
-        if link and "href" in link.attrs:
-            href = link["href"]
+        link = product.css_first(_WM_LINK_SEL)
+        href = link.attributes.get("href") if link else None
+        if href:
             if "rd=" in href:
                 parsed = urllib.parse.parse_qs(urllib.parse.urlparse(href).query)
                 product_url = parsed.get("rd", [href])[0]
@@ -204,31 +239,20 @@ async def scrape_walmart(request: ItemRequest):
 
     return {"results": results}
 
-
-# Target scraper using ScraperAPI
-@app.post("/scrape_target", summary="Scrape Target search results by item name")
-async def scrape_target(request: ItemRequest):
-    item_name = request.item_name.strip()
-    if not item_name:
-        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
-
-    search_query = urllib.parse.quote(item_name)
-    search_url = f"https://www.target.com/s?searchTerm={search_query}"
-    html = await fetch_html(search_url)
-
-    soup = BeautifulSoup(html, "html.parser")
-    product_cards = soup.select('[data-test="product-title"]')
-    prices = soup.select('[data-test="current-price"]')
+def _parse_target(html, search_url):
+    tree = HTMLParser(html)
+    product_cards = tree.css('[data-test="product-title"]')
+    prices = tree.css('[data-test="current-price"]')
 
     if not product_cards:
         return {"results": [], "message": "No products found on Target."}
 
     results = []
     for i, card in enumerate(product_cards[:10]):  # Limit to top 10 for speed
-        title = card.get_text(strip=True)
-        link = card["href"] if card.has_attr("href") else ""
+        title = card.text(strip=True)
+        link = card.attributes.get("href") or ""
         full_url = "https://www.target.com" + link if link else search_url
-        price = prices[i].get_text(strip=True) if i < len(prices) else "Not found"
+        price = prices[i].text(strip=True) if i < len(prices) else "Not found"
 
         results.append({
             "product_name": title,
@@ -238,6 +262,74 @@ async def scrape_target(request: ItemRequest):
 
     return {"results": results}
 
+# Retailer search URL builders and parsers, keyed by retailer name
+_RETAILERS = {
+    "amazon": (lambda q: f"https://www.amazon.com/s?k={q}", _parse_amazon),
+    "walmart": (lambda q: f"https://www.walmart.com/search?q={q}", _parse_walmart),
+    "target": (lambda q: f"https://www.target.com/s?searchTerm={q}", _parse_target),
+}
+
+# Amazon scraper
+@app.post("/scrape_amazon", summary="Scrape Amazon search results by item name")
+async def scrape_amazon(request: ItemRequest):
+    item_name = request.item_name.strip()
+    if not item_name:
+        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
+
+    search_query = urllib.parse.quote(item_name)
+    search_url = f"https://www.amazon.com/s?k={search_query}"
+    html = await fetch_html(search_url)
+    return await asyncio.to_thread(_parse_amazon, html, search_url)
+
+# Walmart scraper using ScraperAPI
+@app.post("/scrape_walmart", summary="Scrape Walmart search results by item name")
+async def scrape_walmart(request: ItemRequest):
+    item_name = request.item_name.strip()
+    if not item_name:
+        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
+
+    search_query = urllib.parse.quote(item_name)
+    search_url = f"https://www.walmart.com/search?q={search_query}"
+    html = await fetch_html(search_url)
+    return await asyncio.to_thread(_parse_walmart, html, search_url)
+
+# Target scraper using ScraperAPI
+@app.post("/scrape_target", summary="Scrape Target search results by item name")
+async def scrape_target(request: ItemRequest):
+    item_name = request.item_name.strip()
+    if not item_name:
+        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
+
+    search_query = urllib.parse.quote(item_name)
+    search_url = f"https://www.target.com/s?searchTerm={search_query}"
+    html = await fetch_html(search_url)
+    return await asyncio.to_thread(_parse_target, html, search_url)
+
+# All three retailers, fetched concurrently and parsed off the event loop
+@app.post("/scrape_all", summary="Scrape Amazon, Walmart, and Target concurrently")
+async def scrape_all(request: ItemRequest):
+    item_name = request.item_name.strip()
+    if not item_name:
+        raise HTTPException(status_code=400, detail="Item name cannot be empty.")
+
+    search_query = urllib.parse.quote(item_name)
+    urls = {retailer: build_url(search_query) for retailer, (build_url, _) in _RETAILERS.items()}
+    htmls = await asyncio.gather(*(fetch_html(url) for url in urls.values()), return_exceptions=True)
+
+    results = {}
+    parse_tasks = {}
+    for (retailer, url), html in zip(urls.items(), htmls):
+        if isinstance(html, Exception):
+            detail = html.detail if isinstance(html, HTTPException) else str(html)
+            results[retailer] = {"results": [], "error": detail}
+        else:
+            parse_tasks[retailer] = asyncio.to_thread(_RETAILERS[retailer][1], html, url)
+    if parse_tasks:
+        parsed = await asyncio.gather(*parse_tasks.values())
+        results.update(zip(parse_tasks.keys(), parsed))
+
+    return {retailer: results[retailer] for retailer in urls}
+
 # For local dev/testing
 if __name__ == "__main__":
     import uvicorn
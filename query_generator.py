@@ -1,30 +1,91 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import Optional, Tuple, Dict, Union
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+import asyncio
 import asyncpg
+import functools
+import difflib
+import hashlib
 import httpx
+import json
+import orjson
 import os
 import re
 import logging
 from dotenv import load_dotenv
 from google.cloud import bigquery
 from google.cloud.exceptions import GoogleCloudError
+try:
+    # Optional: Arrow columnar streaming for large result sets
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
 from google.oauth2 import service_account
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+# Compress large JSON payloads (scrape results, /fetch_data rows) over the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Gemini API configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "GEMINI_API_KEY")
-GEMINI_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_ENDPOINT = "/v1beta/models/gemini-2.0-flash:generateContent"
 MODEL_NAME = "gemini-2.0-flash"
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Fallback model used when the primary model keeps failing after retries
+FALLBACK_MODEL_NAME = "gemini-1.5-flash"
+FALLBACK_ENDPOINT = f"/v1beta/models/{FALLBACK_MODEL_NAME}:generateContent"
+
+# Micro-batching: coalesce prompts arriving within this window into one fan-out
+GEMINI_BATCH_MAX_SIZE = 16
+GEMINI_BATCH_MAX_WAIT = 0.05
+
+# Set up logging; production can silence INFO chatter via LOG_LEVEL
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# Shared HTTP client, created lazily and reused across requests for connection keep-alive
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared httpx client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # base_url pins the Gemini host so keep-alive connections are reused
+        # across calls; absolute URLs (ScraperAPI, DuckDuckGo) still work as-is
+        _http_client = httpx.AsyncClient(
+            base_url=GEMINI_BASE_URL,
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _http_client
+
+async def aclose_http_client():
+    """Close the shared httpx client (called on app shutdown)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+async def warmup_http_client(connections: int = 4):
+    """Open keep-alive connections to Gemini so first requests skip DNS+TLS"""
+    client = get_http_client()
+    try:
+        await asyncio.gather(*(
+            client.head("/v1beta/models", params={"key": GEMINI_API_KEY})
+            for _ in range(connections)
+        ))
+    except Exception as e:
+        logger.warning("Gemini connection warmup failed: %s", e)
+
 # Default PostgreSQL database connection configuration
 DEFAULT_POSTGRES_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -50,12 +111,19 @@ class QueryInput(BaseModel):
     schema_context: Optional[str] = None
     db_config: Optional[DBConfig] = None
 
+# Pre-compiled patterns for clean_sql_query (hot path, avoids re-cache lookups)
+_RE_FENCE = re.compile(r'```sql\s*|\s*```', re.IGNORECASE)
+_RE_WS = re.compile(r'\s+')
+
 def clean_sql_query(query: str) -> str:
     """Remove Markdown code block formatting, newlines, and normalize query"""
-    cleaned_query = re.sub(r'```sql\s*|\s*```', '', query, flags=re.IGNORECASE)
-    cleaned_query = re.sub(r';\s*$', '', cleaned_query)
-    cleaned_query = re.sub(r'\s+', ' ', cleaned_query)
-    return cleaned_query.strip()
+    cleaned_query = query.strip()
+    # Fast paths: most responses carry no fence, and once surrounding
+    # whitespace is stripped a plain removesuffix beats the old `;\s*$` regex
+    if "```" in cleaned_query:
+        cleaned_query = _RE_FENCE.sub('', cleaned_query)
+    cleaned_query = cleaned_query.rstrip().removesuffix(';')
+    return _RE_WS.sub(' ', cleaned_query).strip()
 
 def filter_postgres_config(db_config: Dict[str, str]) -> Dict[str, str]:
     """Filter db_config to include only PostgreSQL-relevant keys"""
@@ -67,221 +135,591 @@ def filter_bigquery_config(db_config: Dict[str, str]) -> Dict[str, str]:
     bigquery_keys = ["project_id", "database", "credentials_path", "credentials_json"]
     return {key: value for key, value in db_config.items() if key in bigquery_keys and value is not None}
 
+# LLM response cache: identical prompts skip the Gemini round-trip entirely
+_llm_cache = TTLCache(maxsize=10_000, ttl=3600)
+_llm_cache_lock = asyncio.Lock()
+
+def _llm_cache_key(prompt: str) -> str:
+    """Build the LLM cache key from the model name and full prompt"""
+    return hashlib.sha256(f"{MODEL_NAME}:{prompt}".encode()).hexdigest()
+
+def _extract_candidate_text(result: Dict) -> str:
+    """Pull the first candidate's text out of a Gemini response body"""
+    return result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
+
+# Cap in-flight Gemini calls across the concurrent batch tasks: a burst beyond
+# this queues locally instead of tripping API rate limits. Acquired per attempt
+# so retry backoff sleeps don't hold a slot.
+GEMINI_MAX_CONCURRENCY = 16
+_gemini_sem = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential_jitter(initial=0.2, max=2),
+       retry=retry_if_exception_type(httpx.HTTPError), reraise=True)
+async def _gemini_post(endpoint: str, body: Dict) -> Dict:
+    """POST to a Gemini endpoint, retrying transient failures with backoff"""
+    client = get_http_client()
+    # orjson both ways: serialize the body to bytes up front and parse the
+    # response from raw bytes, skipping the stdlib json str round-trip
+    async with _gemini_sem:
+        response = await client.post(
+            endpoint,
+            params={"key": GEMINI_API_KEY},
+            headers={"Content-Type": "application/json"},
+            content=orjson.dumps(body)
+        )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+async def _gemini_generate(payload: Dict) -> str:
+    """Send a single generateContent request to Gemini and return the candidate text"""
+    try:
+        result = await _gemini_post(GEMINI_ENDPOINT, payload)
+    except httpx.HTTPError as e:
+        logger.warning("Gemini request failed after retries, falling back to %s: %s", FALLBACK_MODEL_NAME, e)
+        result = await _gemini_post(FALLBACK_ENDPOINT, payload)
+    return _extract_candidate_text(result)
+
+# Gemini micro-batcher: requests queue up and a background task flushes them
+# either when GEMINI_BATCH_MAX_SIZE prompts are waiting or after GEMINI_BATCH_MAX_WAIT
+_gemini_queue: Optional[asyncio.Queue] = None
+_gemini_batcher_task = None
+_gemini_batch_tasks: set = set()
+
+async def _gemini_dispatch_batch(batch: list):
+    """Fan one drained batch out as concurrent generateContent calls and resolve its futures"""
+    # Plain generateContent per prompt, in parallel under _gemini_sem; the
+    # batchGenerateContent API is asynchronous (submit, then poll a long-running
+    # operation) and has no inline-response form, so it doesn't fit this path
+    results = await asyncio.gather(
+        *(_gemini_generate(payload) for payload, _ in batch),
+        return_exceptions=True
+    )
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+async def _gemini_batch_worker():
+    """Drain the Gemini queue, batching prompts that arrive close together"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _gemini_queue.get()]
+        deadline = loop.time() + GEMINI_BATCH_MAX_WAIT
+        while len(batch) < GEMINI_BATCH_MAX_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_gemini_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Backpressure: past the semaphore bound, more batch tasks would only
+        # pile up on the semaphore; stop draining until one in flight finishes
+        while len(_gemini_batch_tasks) >= GEMINI_MAX_CONCURRENCY:
+            await asyncio.wait(set(_gemini_batch_tasks), return_when=asyncio.FIRST_COMPLETED)
+        # Each batch flies in its own task so a slow or retrying call doesn't
+        # head-of-line block the batches forming behind it
+        task = loop.create_task(_gemini_dispatch_batch(batch))
+        _gemini_batch_tasks.add(task)
+        task.add_done_callback(_gemini_batch_tasks.discard)
+
+async def _enqueue_gemini_request(payload: Dict) -> str:
+    """Queue a Gemini request on the micro-batcher and wait for its result"""
+    global _gemini_queue, _gemini_batcher_task
+    if _gemini_queue is None:
+        _gemini_queue = asyncio.Queue()
+        _gemini_batcher_task = asyncio.get_running_loop().create_task(_gemini_batch_worker())
+    future = asyncio.get_running_loop().create_future()
+    await _gemini_queue.put((payload, future))
+    return await future
+
+async def aclose_gemini_batcher():
+    """Stop the Gemini micro-batcher task (called on app shutdown)"""
+    global _gemini_queue, _gemini_batcher_task
+    if _gemini_batcher_task is not None:
+        _gemini_batcher_task.cancel()
+        try:
+            await _gemini_batcher_task
+        except asyncio.CancelledError:
+            pass
+    for task in list(_gemini_batch_tasks):
+        task.cancel()
+    if _gemini_batch_tasks:
+        await asyncio.gather(*_gemini_batch_tasks, return_exceptions=True)
+    _gemini_batch_tasks.clear()
+    _gemini_batcher_task = None
+    _gemini_queue = None
+
+# asyncpg connection pools, one per unique PostgreSQL config; the per-key
+# locks stop concurrent cold-start requests from each creating (and leaking) one
+_pg_pools: Dict[tuple, asyncpg.Pool] = {}
+_pg_pool_locks: Dict[tuple, asyncio.Lock] = {}
+
+async def get_pg_pool(db_config: Dict[str, str]) -> asyncpg.Pool:
+    """Return the shared asyncpg pool for the given config, creating it on first use"""
+    filtered_config = filter_postgres_config(db_config)
+    key = tuple(sorted(filtered_config.items()))
+    pool = _pg_pools.get(key)
+    if pool is not None:
+        return pool
+
+    lock = _pg_pool_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Another request may have created the pool while we waited on the lock
+        pool = _pg_pools.get(key)
+        if pool is None:
+            # min_size keeps warm connections ready for bursts; idle ones above it
+            # are recycled after 5 minutes so unused pools shrink back down
+            pool = await asyncpg.create_pool(
+                min_size=10,
+                max_size=50,
+                max_inactive_connection_lifetime=300,
+                command_timeout=60,
+                **filtered_config
+            )
+            _pg_pools[key] = pool
+    return pool
+
+async def aclose_pg_pools():
+    """Close all asyncpg pools (called on app shutdown)"""
+    for pool in _pg_pools.values():
+        await pool.close()
+    _pg_pools.clear()
+
+# Schema query text is constant so every pooled connection caches one plan
+_PG_SCHEMA_QUERY = """
+SELECT table_name, column_name, data_type
+FROM information_schema.columns
+WHERE table_schema = 'public'
+ORDER BY table_name, ordinal_position
+"""
+
+# Parsed service-account credentials are cached too: from_service_account_*
+# does RSA key setup, which is CPU-heavy enough to matter on client-cache misses
+@functools.lru_cache(maxsize=16)
+def _creds_from_info(cred_json_str: str) -> service_account.Credentials:
+    """Parse inline service-account JSON (passed as a canonical string) once"""
+    return service_account.Credentials.from_service_account_info(orjson.loads(cred_json_str))
+
+@functools.lru_cache(maxsize=16)
+def _creds_from_file(credentials_path: str) -> service_account.Credentials:
+    """Load and parse a service-account key file once per path"""
+    return service_account.Credentials.from_service_account_file(credentials_path)
+
+# BigQuery clients cached by connection identity: construction parses
+# credentials and sets up transport channels, which is pure repeated overhead
+_bq_clients: Dict[tuple, bigquery.Client] = {}
+
+def get_bq_client(db_config: Dict[str, str]) -> bigquery.Client:
+    """Return the shared BigQuery client for the given config, creating it on first use"""
+    filtered_config = filter_bigquery_config(db_config)
+    project_id = filtered_config.get("project_id")
+    credentials_path = filtered_config.get("credentials_path")
+    credentials_json = filtered_config.get("credentials_json")
+
+    if not project_id:
+        raise HTTPException(status_code=400, detail="project_id is required for BigQuery")
+
+    cred_key = None
+    if credentials_json:
+        cred_key = hashlib.sha1(json.dumps(credentials_json, sort_keys=True).encode()).hexdigest()
+    key = (project_id, credentials_path, cred_key)
+    client = _bq_clients.get(key)
+    if client is None:
+        if credentials_json:
+            credentials = _creds_from_info(orjson.dumps(credentials_json, option=orjson.OPT_SORT_KEYS).decode())
+            client = bigquery.Client(project=project_id, credentials=credentials)
+        elif credentials_path:
+            client = bigquery.Client(project=project_id, credentials=_creds_from_file(credentials_path))
+        else:
+            client = bigquery.Client(project=project_id)
+        _bq_clients[key] = client
+    return client
+
 async def get_postgres_schema(db_config: Dict[str, str]) -> str:
     """Fetch PostgreSQL database schema for context"""
     try:
-        filtered_config = filter_postgres_config(db_config)
-        conn = await asyncpg.connect(**filtered_config)
-        schema_query = """
-        SELECT table_name, column_name, data_type
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        """
-        rows = await conn.fetch(schema_query)
-        await conn.close()
-        
-        schema_context = ""
+        pool = await get_pg_pool(db_config)
+        async with pool.acquire(timeout=2.0) as conn:
+            # prepare() hits asyncpg's per-connection statement cache, so a
+            # pooled connection parses/plans the schema query only once
+            stmt = await conn.prepare(_PG_SCHEMA_QUERY)
+            rows = await stmt.fetch()
+
+        # Compact one-line-per-table form keeps the prompt token count low;
+        # append/join builds the string in linear time on wide schemas
+        lines = []
         current_table = None
+        column_specs = []
         for row in rows:
             table = row['table_name']
             if table != current_table:
-                schema_context += f"\nTable: {table}\n"
+                if current_table is not None:
+                    lines.append(f"{current_table}({', '.join(column_specs)})\n")
                 current_table = table
-            schema_context += f"  Column: {row['column_name']} ({row['data_type']})\n"
-        return schema_context
+                column_specs = []
+            column_specs.append(f"{row['column_name']}:{row['data_type']}")
+        if current_table is not None:
+            lines.append(f"{current_table}({', '.join(column_specs)})\n")
+        return "".join(lines)
     except Exception as e:
-        logger.error(f"Failed to fetch PostgreSQL schema: {str(e)}")
+        logger.error("Failed to fetch PostgreSQL schema: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch PostgreSQL schema: {str(e)}")
     
 def get_bigquery_schema(db_config: Dict[str, str]) -> str:
     """Fetch BigQuery dataset schema for context"""
     try:
-        filtered_config = filter_bigquery_config(db_config)
-        project_id = filtered_config.get("project_id")
-        dataset_id = filtered_config.get("database")
-        credentials_path = filtered_config.get("credentials_path")
-        credentials_json = filtered_config.get("credentials_json")
-        
-        if not project_id or not dataset_id:
+        dataset_id = filter_bigquery_config(db_config).get("database")
+        if not dataset_id:
             raise HTTPException(status_code=400, detail="project_id and database (dataset_id) are required for BigQuery")
-        
-        if credentials_json:
-            credentials = service_account.Credentials.from_service_account_info(credentials_json)
-            client = bigquery.Client(project=project_id, credentials=credentials)
-        elif credentials_path:
-            client = bigquery.Client.from_service_account_json(credentials_path, project=project_id)
-        else:
-            client = bigquery.Client(project=project_id)
-        
-        dataset_ref = client.dataset(dataset_id)
-        tables = client.list_tables(dataset_ref)
-        
-        schema_context = ""
-        for table in tables:
-            table_ref = dataset_ref.table(table.table_id)
-            table = client.get_table(table_ref)
-            schema_context += f"\nTable: {table.table_id}\n"
-            for field in table.schema:
-                schema_context += f"  Column: {field.name} ({field.field_type})\n"
-        return schema_context
+        client = get_bq_client(db_config)
+
+        # One INFORMATION_SCHEMA query instead of list_tables + get_table per
+        # table: a single round trip regardless of how many tables exist
+        project_id = filter_bigquery_config(db_config)["project_id"]
+        schema_query = f"""
+        SELECT table_name, column_name, data_type
+        FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.COLUMNS
+        ORDER BY table_name, ordinal_position
+        """
+        rows = client.query(schema_query).result()
+
+        # Compact one-line-per-table form keeps the prompt token count low;
+        # append/join builds the string in linear time on wide schemas
+        lines = []
+        current_table = None
+        column_specs = []
+        for row in rows:
+            table = row["table_name"]
+            if table != current_table:
+                if current_table is not None:
+                    lines.append(f"{current_table}({', '.join(column_specs)})\n")
+                current_table = table
+                column_specs = []
+            column_specs.append(f"{row['column_name']}:{row['data_type']}")
+        if current_table is not None:
+            lines.append(f"{current_table}({', '.join(column_specs)})\n")
+        return "".join(lines)
     except GoogleCloudError as e:
-        logger.error(f"Failed to fetch BigQuery schema: {str(e)}")
+        logger.error("Failed to fetch BigQuery schema: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch BigQuery schema: {str(e)}")
     except Exception as e:
-        logger.error(f"BigQuery error: {str(e)}")
+        logger.error("BigQuery error: %s", e)
         raise HTTPException(status_code=500, detail=f"BigQuery error: {str(e)}")
 
-async def get_db_schema(db_config: Dict[str, str]) -> str:
-    """Fetch schema based on database type"""
+# Schema cache: schemas change rarely, so skip the per-request DB round-trip.
+# The per-key locks stop concurrent cold-cache requests from all hitting the DB.
+_schema_cache = TTLCache(maxsize=128, ttl=300)
+_schema_locks: Dict[tuple, asyncio.Lock] = {}
+
+def _schema_cache_key(db_config: Dict[str, str]) -> tuple:
+    """Build the schema cache key from the connection identity"""
+    return (
+        db_config.get("db_type", "postgres"),
+        db_config.get("host"),
+        db_config.get("database"),
+        db_config.get("user"),
+        db_config.get("port"),
+        db_config.get("project_id"),
+    )
+
+async def get_db_schema(db_config: Dict[str, str], refresh: bool = False) -> str:
+    """Fetch schema based on database type, using the TTL cache unless refresh is set"""
     db_type = db_config.get("db_type", "postgres")
-    if db_type == "postgres":
-        return await get_postgres_schema(db_config)
-    elif db_type == "bigquery":
-        return get_bigquery_schema(db_config)
-    else:
-        raise HTTPException(status_code=400, detail=f"Unsupported db_type: {db_type}")
+    cache_key = _schema_cache_key(db_config)
+    if not refresh:
+        cached_schema = _schema_cache.get(cache_key)
+        if cached_schema is not None:
+            return cached_schema
+
+    lock = _schema_locks.setdefault(cache_key, asyncio.Lock())
+    async with lock:
+        # Another request may have filled the cache while we waited on the lock
+        if not refresh:
+            cached_schema = _schema_cache.get(cache_key)
+            if cached_schema is not None:
+                return cached_schema
 
-async def generate_sql_query(natural_query: str, schema_context: str, db_type: str) -> str:
-    """Generate SQL query using Gemini API"""
+        if db_type == "postgres":
+            schema_context = await get_postgres_schema(db_config)
+        elif db_type == "bigquery":
+            # BigQuery client calls block; keep the event loop free
+            schema_context = await asyncio.to_thread(get_bigquery_schema, db_config)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unsupported db_type: {db_type}")
+
+        _schema_cache[cache_key] = schema_context
+        return schema_context
+
+# Schema linking: on large schemas, send Gemini only the tables that look
+# relevant to the question. Prompt tokens dominate LLM latency and cost.
+_SCHEMA_LINK_MAX_TABLES = 8
+_RE_WORDS = re.compile(r"[a-z0-9_]+")
+# The compact one-line-per-table shape get_db_schema produces; linking only
+# understands this format
+_RE_TABLE_LINE = re.compile(r"[\w.]+\(.+\)\s*")
+_linked_schema_cache = TTLCache(maxsize=4096, ttl=300)
+
+def link_schema_context(natural_query: str, schema_context: str) -> str:
+    """Trim the schema to the tables most relevant to the natural-language query"""
+    lines = [line for line in schema_context.splitlines() if line]
+    if len(lines) <= _SCHEMA_LINK_MAX_TABLES:
+        return schema_context
+    # Caller-supplied schema context can be in any shape (e.g. multi-line
+    # "Table: X / Column: y"); trimming by physical line would sever columns
+    # from their tables, so anything but the compact format passes through
+    if not all(_RE_TABLE_LINE.fullmatch(line) for line in lines):
+        return schema_context
+
+    cache_key = (hashlib.sha256(natural_query.encode()).hexdigest(),
+                 hashlib.sha256(schema_context.encode()).hexdigest())
+    linked = _linked_schema_cache.get(cache_key)
+    if linked is not None:
+        return linked
+
+    tokens = set(_RE_WORDS.findall(natural_query.lower()))
+    scored = []
+    for index, line in enumerate(lines):
+        table, _, columns = line.partition("(")
+        names = [table] + [spec.split(":", 1)[0].strip() for spec in columns.rstrip(")").split(",")]
+        score = 0
+        for name in names:
+            name = name.lower()
+            if name in tokens:
+                score += 2
+            elif difflib.get_close_matches(name, tokens, n=1, cutoff=0.8):
+                score += 1
+        scored.append((score, index))
+
+    # Top-K tables by overlap, kept in their original schema order
+    top = sorted(sorted(scored, key=lambda item: -item[0])[:_SCHEMA_LINK_MAX_TABLES], key=lambda item: item[1])
+    linked = "".join(f"{lines[index]}\n" for _, index in top)
+    _linked_schema_cache[cache_key] = linked
+    return linked
+
+# End-to-end SQL cache keyed on the raw inputs, checked before schema linking
+# or prompt assembly even run; the inflight map coalesces concurrent identical
+# requests into a single Gemini call (singleflight)
+_sql_cache = TTLCache(maxsize=1024, ttl=600)
+_sql_inflight: Dict[tuple, asyncio.Future] = {}
+
+def _sql_cache_key(natural_query: str, schema_context: str, db_type: str) -> tuple:
+    """Build the SQL cache key from the question, schema, and dialect"""
+    return (
+        hashlib.blake2b(natural_query.encode(), digest_size=16).digest(),
+        hashlib.blake2b(schema_context.encode(), digest_size=16).digest(),
+        db_type,
+    )
+
+async def generate_sql_query(natural_query: str, schema_context: str, db_type: str, response: Optional[Response] = None) -> str:
+    """Generate SQL query using Gemini API, caching and coalescing identical requests"""
     if not GEMINI_API_KEY or GEMINI_API_KEY == "GEMINI_API_KEY":
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY environment variable is not set or invalid")
 
+    sql_key = _sql_cache_key(natural_query, schema_context, db_type)
+    while True:
+        cached_query = _sql_cache.get(sql_key)
+        if cached_query is not None:
+            if response is not None:
+                response.headers["X-Cache"] = "HIT"
+            return cached_query
+
+        inflight = _sql_inflight.get(sql_key)
+        if inflight is None:
+            break
+        try:
+            cleaned_query = await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            # The leader's client disconnected; its cancellation isn't ours.
+            # Loop back: either become the new leader or join a fresh flight.
+            if inflight.cancelled():
+                continue
+            raise
+        if response is not None:
+            response.headers["X-Cache"] = "HIT"
+        return cleaned_query
+
+    future = asyncio.get_running_loop().create_future()
+    _sql_inflight[sql_key] = future
+    try:
+        cleaned_query = await _generate_sql_query_uncached(natural_query, schema_context, db_type, response)
+        _sql_cache[sql_key] = cleaned_query
+        future.set_result(cleaned_query)
+        return cleaned_query
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+            future.exception()  # waiters re-raise; mark retrieved here
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _sql_inflight.pop(sql_key, None)
+
+async def _generate_sql_query_uncached(natural_query: str, schema_context: str, db_type: str, response: Optional[Response] = None) -> str:
+    """Generate SQL via Gemini, with the prompt-level TTL cache as a second layer"""
     try:
         sql_dialect = "PostgreSQL" if db_type == "postgres" else "BigQuery Standard SQL"
-        prompt = f"""
-        Convert the following natural language query to a {sql_dialect} SELECT query.
-        Query: {natural_query}
-        Schema: {schema_context}
-        Provide only the SQL query as output, without any explanation or Markdown formatting.
-        """
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{GEMINI_ENDPOINT}?key={GEMINI_API_KEY}",
-                headers={"Content-Type": "application/json"},
-                json={
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 200,
-                        "temperature": 0.7
-                    }
-                }
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            sql_query = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-            if not sql_query:
-                raise ValueError("Empty query generated")
-            
-            cleaned_query = clean_sql_query(sql_query)
-            logger.info(f"Generated SQL query: {cleaned_query}")
-            return cleaned_query
+        schema_context = link_schema_context(natural_query, schema_context)
+        # No leading indentation or filler: prompt tokens are billed and slow generation
+        prompt = (
+            f"Convert the following natural language query to a {sql_dialect} SELECT query.\n"
+            f"Query: {natural_query}\n"
+            f"Schema, one table per line as table(column:type, ...):\n{schema_context.rstrip()}\n"
+            "Provide only the SQL query as output, without any explanation or Markdown formatting."
+        )
+
+        cache_key = _llm_cache_key(prompt)
+        async with _llm_cache_lock:
+            cached_query = _llm_cache.get(cache_key)
+        if cached_query is not None:
+            if response is not None:
+                response.headers["X-Cache"] = "HIT"
+            logger.info("LLM cache hit, skipping Gemini call: %s", cached_query)
+            return cached_query
+        if response is not None:
+            response.headers["X-Cache"] = "MISS"
+
+        payload = {
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }],
+            # Deterministic, short output: keeps decode cheap and makes the
+            # LLM cache safe (temperature > 0 would cache one of many samples)
+            "generationConfig": {
+                "maxOutputTokens": 128,
+                "temperature": 0.0,
+                "topP": 1.0,
+                "candidateCount": 1,
+                "stopSequences": [";"]
+            }
+        }
+        sql_query = await _enqueue_gemini_request(payload)
+        if not sql_query:
+            raise ValueError("Empty query generated")
+
+        cleaned_query = clean_sql_query(sql_query)
+        async with _llm_cache_lock:
+            _llm_cache[cache_key] = cleaned_query
+        logger.info("Generated SQL query: %s", cleaned_query)
+        return cleaned_query
     except httpx.HTTPStatusError as e:
-        logger.error(f"Gemini API error: {e.response.text}")
+        logger.error("Gemini API error: %s", e.response.text)
         raise HTTPException(status_code=500, detail=f"Gemini API request failed: {e.response.text}")
     except Exception as e:
-        logger.error(f"Query generation error: {str(e)}")
+        logger.error("Query generation error: %s", e)
         raise HTTPException(status_code=500, detail=f"Query generation failed: {str(e)}")
 
 async def validate_postgres_query(query: str, db_config: Dict[str, str]) -> Tuple[bool, Optional[str]]:
     """Validate PostgreSQL query"""
     try:
-        filtered_config = filter_postgres_config(db_config)
-        conn = await asyncpg.connect(**filtered_config)
-        await conn.fetch(f"EXPLAIN {query}")
-        await conn.close()
+        pool = await get_pg_pool(db_config)
+        async with pool.acquire(timeout=2.0) as conn:
+            await conn.fetch(f"EXPLAIN {query}")
         return True, None
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"PostgreSQL query validation failed: {str(e)}")
+        logger.error("PostgreSQL query validation failed: %s", e)
         return False, str(e)
     except Exception as e:
-        logger.error(f"PostgreSQL connection error: {str(e)}")
+        logger.error("PostgreSQL connection error: %s", e)
         return False, f"PostgreSQL connection error: {str(e)}"
 
 def validate_bigquery_query(query: str, db_config: Dict[str, str]) -> Tuple[bool, Optional[str]]:
     """Validate BigQuery query using dry run"""
     try:
-        filtered_config = filter_bigquery_config(db_config)
-        project_id = filtered_config.get("project_id")
-        credentials_path = filtered_config.get("credentials_path")
-        credentials_json = filtered_config.get("credentials_json")
-        
-        if not project_id:
-            raise HTTPException(status_code=400, detail="project_id is required for BigQuery")
-        
-        if credentials_json:
-            credentials = service_account.Credentials.from_service_account_info(credentials_json)
-            client = bigquery.Client(project=project_id, credentials=credentials)
-        elif credentials_path:
-            client = bigquery.Client.from_service_account_json(credentials_path, project=project_id)
-        else:
-            client = bigquery.Client(project=project_id)
-        
+        client = get_bq_client(db_config)
+
         job_config = bigquery.QueryJobConfig(dry_run=True)
         client.query(query, job_config=job_config)
         return True, None
     except GoogleCloudError as e:
-        logger.error(f"BigQuery query validation failed: {str(e)}")
+        logger.error("BigQuery query validation failed: %s", e)
         return False, str(e)
     except Exception as e:
-        logger.error(f"BigQuery error: {str(e)}")
+        logger.error("BigQuery error: %s", e)
         return False, f"BigQuery error: {str(e)}"
 
+# Validation cache: SQL that recently passed EXPLAIN/dry-run isn't re-validated
+_valid_cache = TTLCache(maxsize=1024, ttl=300)
+
+def _valid_cache_key(query: str, db_config: Dict[str, str]) -> tuple:
+    """Build the validation cache key from the connection identity and query hash"""
+    return (_schema_cache_key(db_config), hashlib.sha256(query.encode()).hexdigest())
+
 async def validate_query(query: str, db_config: Dict[str, str]) -> Tuple[bool, Optional[str]]:
-    """Validate query based on database type"""
+    """Validate query based on database type, skipping recently validated queries"""
     db_type = db_config.get("db_type", "postgres")
+    cache_key = _valid_cache_key(query, db_config)
+    if cache_key in _valid_cache:
+        return True, None
+
     if db_type == "postgres":
-        return await validate_postgres_query(query, db_config)
+        is_valid, error_message = await validate_postgres_query(query, db_config)
     elif db_type == "bigquery":
-        return validate_bigquery_query(query, db_config)
+        is_valid, error_message = await asyncio.to_thread(validate_bigquery_query, query, db_config)
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported db_type: {db_type}")
 
+    if is_valid:
+        _valid_cache[cache_key] = None
+    return is_valid, error_message
+
 async def fetch_postgres_data(query: str, db_config: Dict[str, str]) -> list:
     """Execute PostgreSQL query and return results"""
     try:
-        filtered_config = filter_postgres_config(db_config)
-        conn = await asyncpg.connect(**filtered_config)
-        rows = await conn.fetch(query)
-        await conn.close()
-        return [dict(row) for row in rows]
+        pool = await get_pg_pool(db_config)
+        results = []
+        async with pool.acquire(timeout=2.0) as conn:
+            # prepare() lets the driver reuse the parse/plan for repeated queries;
+            # the cursor streams rows in batches instead of buffering the full set
+            async with conn.transaction():
+                stmt = await conn.prepare(query)
+                # Column names are fixed per statement: zip each row against a
+                # key tuple built once instead of calling items() on every Record
+                keys = tuple(attr.name for attr in stmt.get_attributes())
+                async for record in stmt.cursor(prefetch=1000):
+                    results.append(dict(zip(keys, record)))
+        return results
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"PostgreSQL query execution failed: {str(e)}")
+        logger.error("PostgreSQL query execution failed: %s", e)
         raise HTTPException(status_code=400, detail=f"PostgreSQL query execution failed: {str(e)}")
     except Exception as e:
-        logger.error(f"PostgreSQL connection error: {str(e)}")
+        logger.error("PostgreSQL connection error: %s", e)
         raise HTTPException(status_code=500, detail=f"PostgreSQL connection error: {str(e)}")
 
+# BigQuery Storage read clients, one per cached bigquery.Client
+_bq_storage_clients: Dict[int, "bigquery_storage.BigQueryReadClient"] = {}
+
+def _get_bq_storage_client(client: bigquery.Client) -> "bigquery_storage.BigQueryReadClient":
+    """Return the Storage Read API client paired with the given BigQuery client"""
+    key = id(client)
+    storage_client = _bq_storage_clients.get(key)
+    if storage_client is None:
+        storage_client = bigquery_storage.BigQueryReadClient(credentials=client._credentials)
+        _bq_storage_clients[key] = storage_client
+    return storage_client
+
 def fetch_bigquery_data(query: str, db_config: Dict[str, str]) -> list:
     """Execute BigQuery query and return results"""
     try:
-        filtered_config = filter_bigquery_config(db_config)
-        project_id = filtered_config.get("project_id")
-        credentials_path = filtered_config.get("credentials_path")
-        credentials_json = filtered_config.get("credentials_json")
-        
-        if not project_id:
-            raise HTTPException(status_code=400, detail="project_id is required for BigQuery")
-        
-        if credentials_json:
-            credentials = service_account.Credentials.from_service_account_info(credentials_json)
-            client = bigquery.Client(project=project_id, credentials=credentials)
-        elif credentials_path:
-            client = bigquery.Client.from_service_account_json(credentials_path, project=project_id)
-        else:
-            client = bigquery.Client(project=project_id)
-        
+        client = get_bq_client(db_config)
+
         query_job = client.query(query)
         rows = query_job.result()
+        if bigquery_storage is not None:
+            # Storage Read API streams columnar Arrow batches instead of
+            # row-by-row REST pages; to_pylist converts to records in one go
+            arrow_table = rows.to_arrow(bqstorage_client=_get_bq_storage_client(client))
+            return arrow_table.to_pylist()
         return [dict(row) for row in rows]
     except GoogleCloudError as e:
-        logger.error(f"BigQuery query execution failed: {str(e)}")
+        logger.error("BigQuery query execution failed: %s", e)
         raise HTTPException(status_code=400, detail=f"BigQuery query execution failed: {str(e)}")
     except Exception as e:
-        logger.error(f"BigQuery error: {str(e)}")
+        logger.error("BigQuery error: %s", e)
         raise HTTPException(status_code=500, detail=f"BigQuery error: {str(e)}")
 
 async def fetch_query_data(query: str, db_config: Dict[str, str]) -> list:
@@ -290,71 +728,104 @@ async def fetch_query_data(query: str, db_config: Dict[str, str]) -> list:
     if db_type == "postgres":
         return await fetch_postgres_data(query, db_config)
     elif db_type == "bigquery":
-        return fetch_bigquery_data(query, db_config)
+        return await asyncio.to_thread(fetch_bigquery_data, query, db_config)
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported db_type: {db_type}")
 
+@app.post("/refresh_schema", summary="Refresh the cached database schema")
+async def refresh_schema(db_config: Optional[DBConfig] = None):
+    """Re-fetch the schema for the given (or default) DB config, bypassing the cache"""
+    config = db_config.dict(exclude_unset=True) if db_config else dict(DEFAULT_POSTGRES_CONFIG)
+    if not config.get("db_type"):
+        config["db_type"] = "postgres"
+    schema_context = await get_db_schema(config, refresh=True)
+    return {"schema_context": schema_context}
+
+async def warmup_default_pg_pool():
+    """Create the default-config pool so the first query skips pool creation"""
+    try:
+        await get_pg_pool(DEFAULT_POSTGRES_CONFIG)
+    except Exception as e:
+        logger.warning("Could not warm default PostgreSQL pool at startup: %s", e)
+
+@app.on_event("startup")
+async def startup_event():
+    """Warm shared connections so the first request skips cold-start handshakes"""
+    await warmup_http_client()
+    await warmup_default_pg_pool()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on app shutdown"""
+    await aclose_gemini_batcher()
+    await aclose_http_client()
+    await aclose_pg_pools()
+
+async def _resolve_and_generate(query_input: QueryInput, response: Optional[Response]) -> Tuple[str, Dict]:
+    """Resolve the DB config, get schema context, and generate the SQL query"""
+    db_config = query_input.db_config.dict(exclude_unset=True) if query_input.db_config else dict(DEFAULT_POSTGRES_CONFIG)
+
+    # Kick the schema lookup off as a task right away; the remaining prep
+    # (and, on pool warm-up, the connection handshake) runs underneath it
+    schema_task = None
+    if not query_input.schema_context:
+        schema_task = asyncio.create_task(get_db_schema(db_config))
+
+    if not db_config.get("db_type"):
+        db_config["db_type"] = "postgres"
+
+    try:
+        schema_context = query_input.schema_context or await schema_task
+        sql_query = await generate_sql_query(query_input.natural_language_query, schema_context, db_config["db_type"], response)
+    finally:
+        if schema_task is not None and not schema_task.done():
+            schema_task.cancel()
+    return sql_query, db_config
+
 @app.post("/generate_query", summary="Generate SQL query from natural language")
-async def generate_query(query_input: QueryInput):
+async def generate_query(query_input: QueryInput, response: Response = None):
     """Generate and validate SQL query"""
     try:
-        # Use provided DB config or default
-        db_config = query_input.db_config.dict(exclude_unset=True) if query_input.db_config else DEFAULT_POSTGRES_CONFIG
-        if not db_config.get("db_type"):
-            db_config["db_type"] = "postgres"
-        
-        # Get schema context from input or database
-        schema_context = query_input.schema_context
-        if not schema_context:
-            schema_context = await get_db_schema(db_config)
-        
-        # Generate SQL query
-        sql_query = await generate_sql_query(query_input.natural_language_query, schema_context, db_config["db_type"])
-        
+        sql_query, db_config = await _resolve_and_generate(query_input, response)
+
         # Validate generated query
         is_valid, error_message = await validate_query(sql_query, db_config)
         if not is_valid:
-            logger.error(f"Invalid query: {sql_query}, Error: {error_message}")
+            logger.error("Invalid query: %s, Error: %s", sql_query, error_message)
             raise HTTPException(status_code=400, detail=f"Error: {error_message} | Generated query: {sql_query}")
-        
+
         return {"query": sql_query}
     
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
+        logger.error("Error processing request: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
 @app.post("/fetch_data", summary="Generate SQL query and fetch data from database")
-async def fetch_data(query_input: QueryInput):
+async def fetch_data(query_input: QueryInput, response: Response = None):
     """Generate SQL query, validate, and fetch data from database"""
     try:
-        # Use provided DB config or default
-        db_config = query_input.db_config.dict(exclude_unset=True) if query_input.db_config else DEFAULT_POSTGRES_CONFIG
-        if not db_config.get("db_type"):
-            db_config["db_type"] = "postgres"
-        
-        # Get schema context from input or database
-        schema_context = query_input.schema_context
-        if not schema_context:
-            schema_context = await get_db_schema(db_config)
-        
-        # Generate SQL query
-        sql_query = await generate_sql_query(query_input.natural_language_query, schema_context, db_config["db_type"])
-        
-        # Validate generated query
-        is_valid, error_message = await validate_query(sql_query, db_config)
-        if not is_valid:
-            logger.error(f"Invalid query: {sql_query}, Error: {error_message}")
-            raise HTTPException(status_code=400, detail=f"Error: {error_message} | Generated query: {sql_query}")
-        
-        # Fetch data
-        data = await fetch_query_data(sql_query, db_config)
-        
+        sql_query, db_config = await _resolve_and_generate(query_input, response)
+
+        # Execution validates for free: prepare()/query() surface the same
+        # errors EXPLAIN/dry-run would, so skip the separate validation
+        # round-trip and translate execution failures into the same shape
+        try:
+            data = await fetch_query_data(sql_query, db_config)
+        except HTTPException as he:
+            if he.status_code == 400:
+                logger.error("Invalid query: %s, Error: %s", sql_query, he.detail)
+                raise HTTPException(status_code=400, detail=f"Error: {he.detail} | Generated query: {sql_query}")
+            raise
+
+        # A query that just ran is valid; let /generate_query skip its EXPLAIN
+        _valid_cache[_valid_cache_key(sql_query, db_config)] = None
+
         return {"query": sql_query, "data": data}
     
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
+        logger.error("Error processing request: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
\ No newline at end of file